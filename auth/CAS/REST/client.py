@@ -30,13 +30,19 @@ services = {
 
 translate = { 'get':'get', 'post':'add', 'delete':'remove' }
 
+url_fields = re.compile(r'{([\w]+)')
+api_name = re.compile(r'/api/([\w]+)/.*')
+
+
+session = requests.Session()
+
 
 def connect(url, method='get'):
-    func = requests.get
+    func = session.get
     if method=='post':
-        func = requests.post
+        func = session.post
     elif method=='delete':
-        func = requests.delete
+        func = session.delete
     try:
         r = func(url)
         return r
@@ -45,16 +51,13 @@ def connect(url, method='get'):
 
 
 
-def connection_factory(cls, url, method):
-    def closure(*args, **kw):
-        attrs = re.findall(re.compile(r'{([\w]+)'),url)
-        kw['client'] = cls.api_key
-        try:
-            assert set(attrs) == set(kw.keys())
-        except AssertionError:
-            attrs.remove('client')
-            raise AssertionError('I need %s.' % set(attrs))
-        link = cls.service_url + url.format(**kw)
+def connection_factory(url, method):
+    attrs = set(url_fields.findall(url))
+    def closure(self, **kw):
+        kw['client'] = self.api_key
+        if attrs != set(kw.keys()):
+            raise AssertionError('I need %s.' % (attrs - set(['client'])))
+        link = self.service_url + url.format(**kw)
         r = connect(link, method)
         return json.loads(r.content.decode())
     closure.__doc__ = 'This function will call "%s" on server with method "%s"' % \
@@ -66,17 +69,9 @@ def connection_factory(cls, url, method):
 
 class Client(object):
     """Client class to use in your applications"""
-    def __new__(cls, api_key, service_url):
-        cls.api_key = api_key
-        cls.service_url = service_url
-        pattern = re.compile(r'/api/([\w]+)/.*')
-        for url in services:
-            match = re.findall(pattern, url)
-            if match and services[url]:
-                for method in services[url]:
-                    new_func_name = '%s_%s' % (translate[method], match[0])
-                    setattr(cls, new_func_name, connection_factory(cls, url, method))
-        return super(Client, cls).__new__(cls)
+    def __init__(self, api_key, service_url):
+        self.api_key = api_key
+        self.service_url = service_url
 
     def __repr__(self):
         output = ['Methods:']
@@ -86,6 +81,14 @@ class Client(object):
         return '\n'.join(output)
 
 
+for url in services:
+    match = api_name.findall(url)
+    if match and services[url]:
+        for method in services[url]:
+            new_func_name = '%s_%s' % (translate[method], match[0])
+            setattr(Client, new_func_name, connection_factory(url, method))
+
+
 if __name__ == '__main__':
     c = Client('tt', 'http://192.168.99.100:4000')
     #c.services
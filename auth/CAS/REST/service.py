@@ -6,46 +6,21 @@
 #    pass
 
 import falcon
+import hashlib
 import json
 try:
     import ujson as json
 except ImportError:
     pass
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from auth.CAS.authorization import Authorization
 
 
 class AuthComponent(object):
-    def process_request(self, req, resp):
-        """Process the request before routing it.
-
-        Args:
-            req: Request object that will eventually be
-                routed to an on_* responder method.
-            resp: Response object that will be routed to
-                the on_* responder.
-        """
-
-    def process_resource(self, req, resp, resource, params):
-        """Process the request after routing.
-
-        Note:
-            This method is only called when the request matches
-            a route to a resource.
-
-        Args:
-            req: Request object that will be passed to the
-                routed responder.
-            resp: Response object that will be passed to the
-                responder.
-            resource: Resource object to which the request was
-                routed.
-            params: A dict-like object representing any additional
-                params derived from the route's URI template fields,
-                that will be passed to the resource's responder
-                method as keyword arguments.
-        """
-
     def process_response(self, req, resp, resource):
         """Post-processing of the response (after routing).
 
@@ -58,118 +33,129 @@ class AuthComponent(object):
         """
         if isinstance(resp.body, dict):
             try:
-                resp.body = json.dumps(resp.body)
-            except(nameError):
+                if orjson is not None:
+                    resp.data = orjson.dumps(resp.body)
+                    resp.body = None
+                else:
+                    resp.body = json.dumps(resp.body)
+            except (TypeError, ValueError, OverflowError):
                 resp.status = falcon.HTTP_500
+                resp.data = None
+                resp.body = json.dumps({'error': 'serialization failed'})
+        if getattr(resource, 'use_etag', False) and resp.status == falcon.HTTP_200:
+            self.set_etag(req, resp)
 
+    def set_etag(self, req, resp):
+        """Tags the serialized body and answers 304 if the client has it"""
+        payload = resp.data if resp.body is None else resp.body.encode('utf-8')
+        etag = '"%s"' % hashlib.sha1(payload).hexdigest()
+        resp.etag = etag
+        if_none_match = req.get_header('If-None-Match') or ''
+        if etag in [i.strip() for i in if_none_match.split(',')]:
+            resp.status = falcon.HTTP_304
+            resp.body = None
+            resp.data = None
 
 
+_authorizations = {}
 
 
-
-
-def stringify(req, resp):
-    """
-    dumps all valid jsons
-    This is the latest after hook
-    """
-    if isinstance(resp.body, dict):
-        try:
-            resp.body = json.dumps(resp.body)
-        except(nameError):
-            resp.status = falcon.HTTP_500
+def get_authorization(client):
+    """Returns the shared Authorization of a client, made on first use"""
+    cas = _authorizations.get(client)
+    if cas is None:
+        if len(_authorizations) >= 1024:
+            _authorizations.clear()
+        cas = _authorizations[client] = Authorization(client)
+    return cas
 
 
 class Ping:
+    pong = json.dumps({'message':'PONG'}).encode('utf-8')
+
     def on_get(self, req, resp):
         """Handles GET requests"""
-        resp.body = {'message':'PONG'}
+        resp.data = self.pong
 
 
 class Membership:
     def on_get(self, req, resp, client, user, group):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.has_membership(user, group):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.has_membership(user, group))}
 
     def on_post(self, req, resp, client, user, group):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.add_membership(user, group):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.add_membership(user, group))}
 
 
     def on_delete(self, req, resp, client, user, group):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.del_membership(user, group):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.del_membership(user, group))}
 
 
 class Permission:
     def on_get(self, req, resp, client, group, name):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.has_permission(group, name):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.has_permission(group, name))}
 
     def on_post(self, req, resp, client, group, name):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.add_permission(group, name):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.add_permission(group, name))}
 
     def on_delete(self, req, resp, client, group, name):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.del_permission(group, name):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.del_permission(group, name))}
 
 class UserPermission:
     def on_get(self, req, resp, client, user, name):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.user_has_permission(user,name):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.user_has_permission(user,name))}
 
 class GetUserPermissions:
+    use_etag = True
+
     def on_get(self, req, resp, client, user):
-        cas = Authorization(client)
+        cas = get_authorization(client)
         resp.body = {'results': cas.get_user_permissions(user)}
 
 
 class GetRolePermissions:
     def on_get(self, req, resp, client, role):
-        cas = Authorization(client)
+        cas = get_authorization(client)
         resp.body = {'results': cas.get_permissions(role)}
 
 
 class GetRoleMembers:
+    use_etag = True
+
     def on_get(self, req, resp, client, role):
-        cas = Authorization(client)
+        cas = get_authorization(client)
         resp.body = {'result': cas.get_role_members(role)}
 
 
 class GetUserRoles:
+    use_etag = True
+
     def on_get(self, req, resp, client, user):
-        cas = Authorization(client)
+        cas = get_authorization(client)
         resp.body = {'result': cas.get_user_roles(user)}
 
 
 class ListRoles:
+    use_etag = True
+
     def on_get(self, req, resp, client):
-        cas = Authorization(client)
+        cas = get_authorization(client)
         resp.body = {'result':cas.roles}
 
 class WhichRolesCan:
     def on_get(self, req, resp, client, name):
-        cas = Authorization(client)
+        cas = get_authorization(client)
         resp.body = {'result':cas.which_roles_can(name)}
 
 class WhichUsersCan:
     def on_get(self, req, resp, client, name):
-        cas = Authorization(client)
+        cas = get_authorization(client)
         resp.body = {'result':cas.which_users_can(name)}
 
 
@@ -178,30 +164,31 @@ class WhichUsersCan:
 
 class Role:
     def on_post(self, req, resp, client, role):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.add_role(role):
-            resp.body={'result':True}
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.add_role(role))}
+
 
+    def on_delete(self, req, resp, client, role):
+        cas = get_authorization(client)
+        resp.body = {'result': bool(cas.del_role(role))}
 
-    def on_delete(self, req, resp, client, group):
-        cas = Authorization(client)
-        resp.body={'result':False}
-        if cas.del_role(group):
-            resp.body={'result':True}
 
 
+routes = (
+    ('/ping', Ping),
+    ('/api/membership/{client}/{user}/{group}', Membership),  ## POST DELETE GET
+    ('/api/permission/{client}/{group}/{name}', Permission),  ## POST DELETE GET
+    ('/api/has_permission/{client}/{user}/{name}', UserPermission),  ## GET
+    ('/api/user_permissions/{client}/{user}', GetUserPermissions),  ## GET
+    ('/api/role_permissions/{client}/{role}', GetRolePermissions),  ## GET
+    ('/api/user_roles/{client}/{user}', GetUserRoles),  ## GET
+    ('/api/members/{client}/{role}', GetRoleMembers),  ## GET
+    ('/api/role/{client}/{role}', Role),  ## POST DELETE
+    ('/api/roles/{client}', ListRoles),  ## GET
+    ('/api/which_roles_can/{client}/{name}', WhichRolesCan),  ## GET
+    ('/api/which_users_can/{client}/{name}', WhichUsersCan),  ## GET
+)
 
 api = falcon.API(middleware=[AuthComponent()])
-api.add_route('/ping', Ping())
-api.add_route('/api/membership/{client}/{user}/{group}', Membership())  ## POST DELETE GET
-api.add_route('/api/permission/{client}/{group}/{name}', Permission())  ## POST DELETE GET
-api.add_route('/api/has_permission/{client}/{user}/{name}', UserPermission())  ## GET
-api.add_route('/api/user_permissions/{client}/{user}', GetUserPermissions())  ## GET
-api.add_route('/api/role_permissions/{client}/{role}', GetRolePermissions())  ## GET
-api.add_route('/api/user_roles/{client}/{user}', GetUserRoles())  ## GET
-api.add_route('/api/members/{client}/{role}', GetRoleMembers())  ## GET
-api.add_route('/api/role/{client}/{role}', Role())  ## POST DELETE
-api.add_route('/api/roles/{client}', ListRoles())  ## GET
-api.add_route('/api/which_roles_can/{client}/{name}', WhichRolesCan())  ## GET
-api.add_route('/api/which_users_can/{client}/{name}', WhichUsersCan())  ## GET
+for url, resource in routes:
+    api.add_route(url, resource())
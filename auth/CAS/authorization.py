@@ -1,15 +1,71 @@
 #!/usr/bin/env python
 
 ## AuthGroup, AuthPermission, AuthMembership
-import json
-try:
-    import ujson as json
-except ImportError:
-    pass
-
+import os
+import time
+import datetime
+import functools
 from auth.CAS.models.db import *
 from mongoengine.errors import NotUniqueError
 
+try:
+    from mongoengine.errors import BulkWriteError
+except ImportError:  # older mongoengine raises NotUniqueError only
+    BulkWriteError = NotUniqueError
+
+
+CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL') or 0)
+CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE') or 10000)
+CACHE_CLIENTS = 1024
+_cache = {}
+_generations = {}
+
+
+def cached(fn):
+    """Keeps check results per client for CACHE_TTL seconds (0 disables)"""
+    names = fn.__code__.co_varnames[1:fn.__code__.co_argcount]
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kw):
+        if kw:
+            # key on positional values so keyword calls share entries
+            args = args + tuple(kw.pop(name) for name in names[len(args):] if name in kw)
+        if not CACHE_TTL or kw:
+            return fn(self, *args, **kw)
+        entries = _cache.get(self.client)
+        if entries is None:
+            if len(_cache) >= CACHE_CLIENTS:
+                _cache.clear()
+            entries = _cache[self.client] = {}
+        key = (fn.__name__,) + args
+        now = time.time()
+        hit = entries.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+        generation = _generations.get(self.client, 0)
+        result = fn(self, *args)
+        if _generations.get(self.client, 0) != generation:
+            # a write landed while we were reading, don't keep the old answer
+            return result
+        if len(entries) >= CACHE_SIZE:
+            entries.clear()
+        entries[key] = (now + CACHE_TTL, result)
+        return result
+    return wrapper
+
+
+def invalidates(fn):
+    """Drops cached checks of the client after a write"""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kw):
+        try:
+            return fn(self, *args, **kw)
+        finally:
+            if self.client not in _generations and len(_generations) >= CACHE_CLIENTS:
+                _generations.clear()
+            _generations[self.client] = _generations.get(self.client, 0) + 1
+            _cache.pop(self.client, None)
+    return wrapper
+
 
 class Authorization(object):
     """ Main Authorization class """
@@ -24,57 +80,70 @@ class Authorization(object):
     @property
     def roles(self):
         """gets user groups"""
-        result = AuthGroup.objects(creator=self.client).only('role')
-        return json.loads(result.to_json())
+        result = AuthGroup.objects(creator=self.client).scalar('role')
+        return [{'role': role} for role in result]
 
     def get_permissions(self, role):
         """gets permissions of role"""
-        target_role = AuthGroup.objects(role=role, creator=self.client).first()
+        target_role = AuthGroup.objects(role=role, creator=self.client).only('id').first()
         if not target_role:
-            return '[]'
-        targets = AuthPermission.objects(groups=target_role, creator=self.client).only('name')
-        return json.loads(targets.to_json())
+            return []
+        targets = AuthPermission.objects(groups=target_role, creator=self.client).scalar('name')
+        return [{'name': name} for name in targets]
 
 
     def get_user_permissions(self, user):
         """get permissions of a user"""
-        memberShipRecords = AuthMembership.objects(creator=self.client, user=user).only('groups')
-        results = []
-        for each in memberShipRecords:
-            for group in each.groups:
-                targetPermissionRecords = AuthPermission.objects(creator=self.client,
-                                            groups=group).only('name')
-
-                for each_permission in targetPermissionRecords:
-                    results.append({'name':each_permission.name})
-        return results
+        memberShipRecords = AuthMembership.objects(creator=self.client,
+                                                   user=user).only('groups').as_pymongo()
+        groups = [group for each in memberShipRecords for group in each.get('groups', [])]
+        targets = AuthPermission.objects(creator=self.client, groups__in=groups).scalar('name')
+        return [{'name': name} for name in targets]
 
     def get_user_roles(self, user):
         """get permissions of a user"""
-        memberShipRecords = AuthMembership.objects(creator=self.client, user=user).only('groups')
-        results = []
-        for each in memberShipRecords:
-            for group in each.groups:
-                results.append({'role':group.role})
-        return results
+        memberShipRecords = AuthMembership.objects(creator=self.client,
+                                                   user=user).only('groups').as_pymongo()
+        groups = [group for each in memberShipRecords for group in each.get('groups', [])]
+        return self._roles_of(groups)
 
 
     def get_role_members(self, role):
         """get permissions of a user"""
         targetRoleDb = AuthGroup.objects(creator=self.client, role=role)
-        members = AuthMembership.objects(groups__in=targetRoleDb).only('user')
-        return json.loads(members.to_json())
+        members = AuthMembership.objects(groups__in=targetRoleDb).scalar('user')
+        return [{'user': user} for user in members]
+
+    def _roles_of(self, groups):
+        """role names of group ids, in the given order"""
+        roles = dict(AuthGroup.objects(id__in=groups).scalar('id', 'role'))
+        return [{'role': roles[group]} for group in groups if group in roles]
 
     def which_roles_can(self, name):
         """Which role can SendMail? """
-        targetPermissionRecords = AuthPermission.objects(creator=self.client, name=name).first()
-        return [{'role': group.role} for group in targetPermissionRecords.groups]
+        permission = AuthPermission.objects(creator=self.client,
+                                            name=name).only('groups').as_pymongo().first()
+        if not permission:
+            return []
+        return self._roles_of(permission.get('groups', []))
 
     def which_users_can(self, name):
-        """Which role can SendMail? """
-        _roles = self.which_roles_can(name)
-        result =  [self.get_role_members(i.get('role')) for i in _roles]
-        return result
+        """Which users can SendMail? grouped per role"""
+        permission = AuthPermission.objects(creator=self.client,
+                                            name=name).only('groups').as_pymongo().first()
+        if not permission:
+            return []
+        # skip ids of deleted groups so the result lines up with which_roles_can
+        alive = set(AuthGroup.objects(id__in=permission.get('groups', [])).scalar('id'))
+        groups = [group for group in permission.get('groups', []) if group in alive]
+        members = dict((group, []) for group in groups)
+        records = AuthMembership.objects(creator=self.client,
+                                         groups__in=groups).only('user', 'groups').as_pymongo()
+        for record in records:
+            for group in record['groups']:
+                if group in members:
+                    members[group].append({'user': record['user']})
+        return [members[group] for group in groups]
 
     def get_role(self, role):
         """Returns a role object
@@ -82,6 +151,7 @@ class Authorization(object):
         role = AuthGroup.objects(role=role, creator=self.client).first()
         return role
 
+    @invalidates
     def add_role(self, role, description=None):
         """ Creates a new group """
         new_group = AuthGroup(role=role, creator=self.client)
@@ -91,93 +161,135 @@ class Authorization(object):
         except NotUniqueError:
             return False
 
+    @invalidates
+    def add_roles(self, roles):
+        """ Creates several groups at once, returns number of new ones """
+        existing = set(AuthGroup.objects(role__in=roles, creator=self.client).scalar('role'))
+        now = datetime.datetime.now()
+        new_groups = []
+        seen = set(existing)
+        for role in roles:
+            if role not in seen:
+                seen.add(role)
+                group = AuthGroup(role=role, creator=self.client, modified=now)
+                group.validate()  # insert() skips validation
+                new_groups.append(group)
+        if not new_groups:
+            return 0
+        try:
+            AuthGroup.objects.insert(new_groups, load_bulk=False)
+        except (NotUniqueError, BulkWriteError):
+            # raced with another writer, the ordered insert stopped at the
+            # duplicate, so retry the ones still missing and count from the db
+            stored = set(AuthGroup.objects(role__in=roles, creator=self.client).scalar('role'))
+            missing = [group for group in new_groups if group.role not in stored]
+            if missing:
+                try:
+                    AuthGroup.objects.insert(missing, load_bulk=False)
+                except (NotUniqueError, BulkWriteError):
+                    pass
+            stored = set(AuthGroup.objects(role__in=roles, creator=self.client).scalar('role'))
+            return len(stored - existing)
+        return len(new_groups)
+
+    @invalidates
     def del_role(self, role):
         """ deletes a group """
-        target = AuthGroup.objects(role=role, creator=self.client).first()
-        if target:
-            target.delete()
-            return True
-        else:
+        targetGroup = AuthGroup.objects(role=role, creator=self.client).only('id').first()
+        if not targetGroup:
             return False
+        # references are not cleaned up by mongoengine, drop them first
+        AuthMembership.objects(creator=self.client, groups=targetGroup).update(
+                pull__groups=targetGroup)
+        AuthPermission.objects(creator=self.client, groups=targetGroup).update(
+                pull__groups=targetGroup)
+        deleted = AuthGroup.objects(id=targetGroup.id).delete()
+        return bool(deleted)
 
+    @invalidates
     def add_membership(self, user, role):
         """ make user a member of a group """
-        targetGroup = AuthGroup.objects(role=role, creator=self.client).first()
-        if not targetGroup:
-            return False
+        return self.add_memberships(user, [role])
 
-        target = AuthMembership.objects(user=user, creator=self.client).first()
-        if not target:
-            target = AuthMembership(user=user, creator=self.client)
-
-        if not role in [i.role for i in target.groups]:
-            target.groups.append(targetGroup)
-            target.save()
+    @invalidates
+    def add_memberships(self, user, roles):
+        """ make user a member of several groups at once """
+        if not roles:
+            return False
+        targetGroups = list(AuthGroup.objects(role__in=roles, creator=self.client).only('id'))
+        if len(targetGroups) != len(set(roles)):
+            return False
+        now = datetime.datetime.now()
+        AuthMembership.objects(user=user, creator=self.client).update_one(
+                add_to_set__groups=targetGroups, set__modified=now,
+                set_on_insert__date_created=now, upsert=True
+        )
         return True
 
 
+    @invalidates
     def del_membership(self, user, role):
         """  dismember user from a group """
-        if not self.has_membership(user, role):
-            return True
-        targetRecord = AuthMembership.objects(creator=self.client, user=user).first()
-        if not targetRecord:
-            return True
-        for group in targetRecord.groups:
-            if group.role==role:
-                targetRecord.groups.remove(group)
-        targetRecord.save()
+        targetGroup = AuthGroup.objects(role=role, creator=self.client).only('id').first()
+        if targetGroup:
+            AuthMembership.objects(creator=self.client, user=user).update_one(
+                    pull__groups=targetGroup,
+                    set__modified=datetime.datetime.now()
+            )
         return True
 
+    @cached
     def has_membership(self, user, role):
         """ checks if user is member of a group"""
-        targetRecord = AuthMembership.objects(creator=self.client, user=user).first()
-        if targetRecord:
-            return role in [i.role for i in targetRecord.groups]
-        return False
+        targetGroup = AuthGroup.objects(role=role, creator=self.client).only('id').first()
+        if not targetGroup:
+            return False
+        target = AuthMembership.objects(creator=self.client, user=user,
+                                        groups=targetGroup).only('id').first()
+        return target is not None
 
 
+    @invalidates
     def add_permission(self, role, name):
         """ authorize a group for something """
-        if self.has_permission(role, name):
-            return True
-        targetGroup = AuthGroup.objects(role=role, creator=self.client).first()
+        targetGroup = AuthGroup.objects(role=role, creator=self.client).only('id').first()
         if not targetGroup:
             return False
-        # Create or update
-        permission = AuthPermission.objects(name=name).update(
-                add_to_set__groups=[targetGroup], creator=self.client, upsert=True
+        # Create or update, $addToSet keeps it idempotent
+        now = datetime.datetime.now()
+        AuthPermission.objects(name=name, creator=self.client).update(
+                add_to_set__groups=[targetGroup], set__modified=now,
+                set_on_insert__date_created=now, upsert=True
         )
         return True
 
+    @invalidates
     def del_permission(self, role, name):
         """ revoke authorization of a group """
-        if not self.has_permission(role, name):
-            return True
-        targetGroup = AuthGroup.objects(role=role, creator=self.client).first()
-        target = AuthPermission.objects(groups=targetGroup, name=name, creator=self.client).first()
-        if not target:
-            return True
-        target.delete()
+        targetGroup = AuthGroup.objects(role=role, creator=self.client).only('id').first()
+        if targetGroup:
+            AuthPermission.objects(groups=targetGroup, name=name, creator=self.client).delete()
         return True
 
+    @cached
     def has_permission(self, role, name):
         """ verify groups authorization """
-        targetGroup = AuthGroup.objects(role=role, creator=self.client).first()
+        targetGroup = AuthGroup.objects(role=role, creator=self.client).only('id').first()
         if not targetGroup:
             return False
-        target = AuthPermission.objects(groups=targetGroup, name=name, creator=self.client).first()
+        target = AuthPermission.objects(groups=targetGroup, name=name, creator=self.client).only('id').first()
         if target:
             return True
         return  False
 
+    @cached
     def user_has_permission(self, user, name):
         """ verify user has permission """
-        targetRecord = AuthMembership.objects(creator=self.client, user=user).first()
+        targetRecord = AuthMembership.objects(creator=self.client,
+                                              user=user).only('groups').as_pymongo().first()
         if not targetRecord:
             return False
-        for group in targetRecord.groups:
-            if self.has_permission(group.role, name):
-                return True
-        return False
+        target = AuthPermission.objects(creator=self.client, name=name,
+                                        groups__in=targetRecord.get('groups', [])).only('id').first()
+        return target is not None
 
@@ -37,11 +37,23 @@ from mongoengine import signals
 
 
 
+_connection = None
+
+
 def make_db_connection():
-    mongo_host = os.getenv('MONGO_HOST') or '127.0.0.1'
-    _mongo_port = os.getenv('MONGO_PORT') or 27017
-    mongo_port = int(_mongo_port)
-    connect('Authorization_0x0199', host=mongo_host, port=mongo_port)
+    """Connects to mongodb once per process and reuses the client after"""
+    global _connection
+    if _connection is None:
+        mongo_host = os.getenv('MONGO_HOST') or '127.0.0.1'
+        _mongo_port = os.getenv('MONGO_PORT') or 27017
+        mongo_port = int(_mongo_port)
+        options = {}
+        _pool_size = os.getenv('MONGO_POOL_SIZE')
+        if _pool_size:
+            options['maxPoolSize'] = int(_pool_size)
+        _connection = connect('Authorization_0x0199', host=mongo_host, port=mongo_port,
+                              **options)
+    return _connection
 
 
 def handler(event):
@@ -67,9 +79,11 @@ class AuthGroup(Document):
     role = StringField(max_length=32, unique_with='creator', required=True)
     description = StringField(max_length=256)
     is_active = BooleanField(default=True)
-    date_created = DateTimeField(default=datetime.datetime.now())
+    date_created = DateTimeField(default=datetime.datetime.now)
     modified = DateTimeField()
 
+    meta = {'indexes': ['creator']}
+
     def __repr__(self):
         return '{}: <{}>'.format(
             self.__class__.__name__,
@@ -83,9 +97,11 @@ class AuthMembership(Document):
     creator = StringField(max_length=64, required=True)
     groups = ListField(ReferenceField(AuthGroup))
     is_active = BooleanField(default=True)
-    date_created = DateTimeField(default=datetime.datetime.now())
+    date_created = DateTimeField(default=datetime.datetime.now)
     modified = DateTimeField()
 
+    meta = {'indexes': ['groups']}
+
     def __repr__(self):
         return '{}: <{}>'.format(
             self.__class__.__name__,
@@ -106,9 +122,11 @@ class AuthPermission(Document):
     creator = StringField(max_length=64, required=True)
     groups = ListField(ReferenceField(AuthGroup, required=True))
     is_active = BooleanField(default=True)
-    date_created = DateTimeField(default=datetime.datetime.now())
+    date_created = DateTimeField(default=datetime.datetime.now)
     modified = DateTimeField()
 
+    meta = {'indexes': [('creator', 'groups')]}
+
     def __repr__(self):
         return '{}: <{}>'.format(
             self.__class__.__name__,
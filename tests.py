@@ -4,6 +4,7 @@ from mongoengine import connect
 from mongoengine.connection import get_connection
 
 from auth import Authorization
+from auth.CAS import authorization
 from auth.CAS.models.db import AuthGroup, AuthPermission, AuthMembership
 
 # CONFTEST
@@ -111,15 +112,118 @@ def test_authorization_delete_member(cas):
     cas.del_membership('josh', 'other')
     assert cas.has_membership('josh', 'other') == False
 
+def test_authorization_has_membership_ignores_dangling_roles(cas):
+    cas.add_role('dangling')
+    cas.add_membership('kripke', 'dangling')
+    cas.add_membership('kripke', 'other')
+    AuthGroup.objects(role='dangling', creator=cas.client).delete()
+    assert cas.has_membership('kripke', 'other') == True
+    assert cas.has_membership('kripke', 'dangling') == False
+
 def test_authorization_delete_role(cas):
     cas.add_role('intruder')
     assert {'role': 'intruder'} in cas.roles
     cas.del_role('intruder')
     assert {'role': 'intruder'} not in cas.roles
 
+def test_authorization_deleted_role_grants_nothing(cas):
+    cas.add_role('editors')
+    cas.add_permission('editors', 'edit')
+    cas.add_membership('bernadette', 'editors')
+    assert cas.user_has_permission('bernadette', 'edit') == True
+    cas.del_role('editors')
+    assert cas.user_has_permission('bernadette', 'edit') == False
+    assert cas.has_membership('bernadette', 'editors') == False
+
 def test_authorization_delete_permission(cas):
     cas.add_permission('admin','fake permission')
     assert {'name': 'fake permission'} in cas.get_permissions('admin')
     cas.del_permission('admin', 'fake permission')
     assert {'name': 'fake permission'} not in cas.get_permissions('admin')
 
+
+def test_authorization_get_permissions_of_unknown_role(cas):
+    assert cas.get_permissions('nobody') == []
+
+def test_authorization_add_memberships(cas):
+    assert cas.add_memberships('penny', ['group', 'other']) == True
+    assert cas.has_membership('penny', 'group') == True
+    assert cas.has_membership('penny', 'other') == True
+    assert cas.add_memberships('penny', ['group', 'missing']) == False
+    assert cas.add_memberships('stuart', []) == False
+    assert AuthMembership.objects(creator=cas.client, user='stuart').count() == 0
+
+def test_authorization_permission_is_scoped_to_client(cas):
+    other = Authorization('GenosDemonCyborg')
+    other.add_role('admin')
+    other.add_permission('admin', 'read')
+    assert {'name': 'read'} in cas.get_permissions('admin')
+    assert {'name': 'read'} in other.get_permissions('admin')
+
+def test_authorization_add_roles(cas):
+    for role in ['auditor', 'reporter']:
+        cas.del_role(role)
+    cas.add_role('viewer')
+    assert cas.add_roles(['viewer', 'auditor', 'reporter', 'auditor']) == 2
+    assert {'role': 'auditor'} in cas.roles
+    assert {'role': 'reporter'} in cas.roles
+    assert cas.add_roles(['auditor', 'reporter']) == 0
+
+def test_authorization_add_roles_validates(cas):
+    with pytest.raises(mongoengine.ValidationError):
+        cas.add_roles(['ok', 'x' * 40])
+    assert AuthGroup.objects(creator=cas.client, role__in=['ok', 'x' * 40]).count() == 0
+
+def test_authorization_cache_is_invalidated_on_write(cas, monkeypatch):
+    monkeypatch.setattr(authorization, 'CACHE_TTL', 60)
+    cas.add_permission('admin', 'cached permission')
+    assert cas.has_permission('admin', 'cached permission') == True
+    cas.del_permission('admin', 'cached permission')
+    assert cas.has_permission('admin', 'cached permission') == False
+
+def test_authorization_cache_skips_results_raced_by_a_write(cas, monkeypatch):
+    monkeypatch.setattr(authorization, 'CACHE_TTL', 60)
+    cas.add_permission('admin', 'raced permission')
+    real = AuthPermission.objects.__class__.first
+    def first(self):
+        result = real(self)
+        if self._document is not AuthPermission:
+            return result
+        # the write commits while the check is still reading
+        monkeypatch.setattr(AuthPermission.objects.__class__, 'first', real)
+        cas.del_permission('admin', 'raced permission')
+        return result
+    monkeypatch.setattr(AuthPermission.objects.__class__, 'first', first)
+    assert cas.has_permission('admin', 'raced permission') == True
+    assert cas.has_permission('admin', 'raced permission') == False
+
+def test_authorization_which_users_can(cas):
+    assert [{'user': 'sheldon'}] in cas.which_users_can('write')
+    assert cas.which_users_can('nothing at all') == []
+
+def test_authorization_which_users_can_skips_deleted_roles(cas):
+    cas.add_role('ghosts')
+    cas.add_permission('ghosts', 'haunt')
+    cas.add_membership('barry', 'ghosts')
+    # leave a dangling id behind, as del_role did before it cleaned up
+    AuthGroup.objects(role='ghosts', creator=cas.client).delete()
+    assert cas.which_users_can('haunt') == []
+    assert len(cas.which_users_can('haunt')) == len(cas.which_roles_can('haunt'))
+
+def test_authorization_which_roles_can_unknown_permission(cas):
+    assert cas.which_roles_can('nothing at all') == []
+
+def test_authorization_checks_accept_keywords(cas, monkeypatch):
+    assert cas.has_permission(role='admin', name='read') == True
+    assert cas.has_membership(user='sheldon', role='admin') == True
+    monkeypatch.setattr(authorization, 'CACHE_TTL', 60)
+    assert cas.user_has_permission('sheldon', name='read') == True
+    assert cas.user_has_permission(user='sheldon', name='read') == True
+
+
+def test_authorization_cache_bounds_clients(monkeypatch):
+    monkeypatch.setattr(authorization, 'CACHE_TTL', 60)
+    monkeypatch.setattr(authorization, 'CACHE_CLIENTS', 2)
+    for client in ['c1', 'c2', 'c3']:
+        Authorization(client).has_permission('admin', 'read')
+    assert len(authorization._cache) <= 2